@@ -0,0 +1,145 @@
+"""
+compares Read_Excel_Input in DataFrame mode (default) and streaming mode on a synthetic input Excel file
+
+usage: python benchmark_read_excel_input.py [n_tabs] [n_items] [n_periods]
+       python benchmark_read_excel_input.py --check [input_dir]
+
+each mode runs in its own process so that peak memory (max RSS) is measured separately.
+--check reads every input Excel file in input_dir (default: input/) in both modes with each registered format and 
+checks that rei.data, rei.items and rei.validation_report are the same
+"""
+import os
+import sys
+import time
+import resource
+import subprocess
+import tempfile
+
+import numpy as np
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_input_excel_file(file_name, n_tabs=10, n_items=500, n_periods=10, seed=0, all_integers=False, n_empty_tabs=0):
+    """
+    writes an input Excel file with n_tabs sources in the Samchully layout, each with n_items items over n_periods periods
+    
+    - all_integers (bool): no empty cell (otherwise every 7th item misses its last period)
+    - n_empty_tabs (int): empty sheets listed in metadata after the others
+    """
+    rng = np.random.default_rng(seed)
+    wb = Workbook(write_only=True)
+    metadata = wb.create_sheet('metadata')
+    metadata.append(['tab', 'name'])
+    for i in range(n_tabs):
+        tab = str(2000 + i)
+        metadata.append([tab, f'FY{tab}'])
+        ws = wb.create_sheet(tab)
+        ws.append([None] + [f'제 {i + j} 기' for j in range(n_periods)])
+        values = rng.integers(-10**9, 10**9, size=(n_items, n_periods))
+        for row_num in range(n_items):
+            row = values[row_num].tolist()
+            if row_num % 7 == 0 and not all_integers:
+                row[-1] = None
+            ws.append([f'item {row_num}'] + row)
+    for i in range(n_empty_tabs):
+        tab = f'empty {i}'
+        metadata.append([tab, tab])
+        wb.create_sheet(tab)
+    wb.save(file_name)
+
+
+def run(input_excel_file, streaming):
+    """
+    reads input_excel_file in one mode and prints (seconds, max RSS in MB, number of records)
+    """
+    from consolidate_as_reported_tables.read_excel_input import Read_Excel_Input
+
+    start = time.perf_counter()
+    rei = Read_Excel_Input(input_excel_file, streaming=streaming)
+    seconds = time.perf_counter() - start
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+    print(f'RESULT {seconds:.2f} {max_rss:.0f} {len(rei.data)}')
+
+
+def main(n_tabs=10, n_items=500, n_periods=10):
+    with tempfile.TemporaryDirectory() as tmp:
+        input_excel_file = os.path.join(tmp, 'benchmark_input.xlsx')
+        print(f'Writing {n_tabs} tabs x {n_items} items x {n_periods} periods...')
+        make_input_excel_file(input_excel_file, n_tabs, n_items, n_periods)
+        print(f'{os.path.getsize(input_excel_file) / 2**20:.1f} MB')
+
+        for streaming in (False, True):
+            output = subprocess.run(
+                [sys.executable, __file__, '--run', input_excel_file, str(int(streaming))],
+                capture_output=True, text=True, check=True).stdout
+            seconds, max_rss, n_records = output.rsplit('RESULT ', 1)[1].split()
+            mode = 'streaming' if streaming else 'DataFrame'
+            print(f'{mode:>10}: {float(seconds):7.2f} s, max RSS {int(max_rss):5d} MB, {int(n_records)} records')
+
+
+def _read(input_excel_file, sheet_format, streaming):
+    """
+    Helper function for check(): Read_Excel_Input after reading input_excel_file in one mode, 
+    with its validation report when validation fails
+    """
+    import contextlib
+    from consolidate_as_reported_tables.read_excel_input import Read_Excel_Input
+
+    rei = Read_Excel_Input(None, sheet_format=sheet_format)
+    with contextlib.redirect_stdout(None):
+        try:
+            if streaming:
+                rei.stream_excel_input(input_excel_file)
+            else:
+                rei.read_excel_input(input_excel_file)
+                rei.validate_raw_data()
+                rei.process_raw_data()
+                rei.initialize_data()
+        except ValueError:
+            pass
+    return rei
+
+
+def check(input_dir='input'):
+    """
+    reads every input Excel file in input_dir, and synthetic ones with integers only and with an empty tab, 
+    in both modes and compares rei.data, rei.items and rei.validation_report
+    """
+    import pandas as pd
+    from consolidate_as_reported_tables import clean_format
+
+    tmp = tempfile.TemporaryDirectory()
+    input_excel_files = [os.path.join(input_dir, x) for x in sorted(os.listdir(input_dir)) 
+                         if x.endswith('.xlsx') and not x.startswith('~$')]
+    input_excel_files.append(os.path.join(tmp.name, 'all_integers.xlsx'))
+    make_input_excel_file(input_excel_files[-1], n_tabs=3, n_items=50, n_periods=5, all_integers=True)
+    input_excel_files.append(os.path.join(tmp.name, 'empty_tab.xlsx'))
+    make_input_excel_file(input_excel_files[-1], n_tabs=2, n_items=50, n_periods=5, n_empty_tabs=1)
+
+    n_different = 0
+    for input_excel_file in input_excel_files:
+        file_name = os.path.basename(input_excel_file)
+        for sheet_format in clean_format.ROW_FORMATS:
+            default, streaming = (_read(input_excel_file, sheet_format, x) for x in (False, True))
+            try:
+                pd.testing.assert_frame_equal(default.validation_report, streaming.validation_report)
+                pd.testing.assert_frame_equal(default.data, streaming.data)
+                pd.testing.assert_frame_equal(default.items, streaming.items)
+                result = f'same ({len(default.validation_report)} problems, {len(default.data)} records)'
+            except AssertionError as e:
+                n_different += 1
+                result = f'DIFFERENT: {e}'
+            print(f'{file_name} [{sheet_format}]: {result}')
+    tmp.cleanup()
+    return n_different
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run']:
+        run(sys.argv[2], streaming=bool(int(sys.argv[3])))
+    elif sys.argv[1:2] == ['--check']:
+        sys.exit(check(*sys.argv[2:3]) > 0)
+    else:
+        main(*map(int, sys.argv[1:]))
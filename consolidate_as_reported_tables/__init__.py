@@ -1,2 +1,3 @@
 from .read_excel_input import *
 from .consolidated_table import *
+from .rerun import *
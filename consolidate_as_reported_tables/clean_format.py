@@ -1,15 +1,201 @@
+import numpy as np
+import pandas as pd
+
+
+# FORMAT ADAPTERS: THEIR IMPLEMENTATION MAY VARY DEPENDING ON SOURCE
+#
+# Each adapter takes a sheet as read by pd.read_excel and its row in metadata (dict), and returns the sheet
+# with 'item' as the first column and periods as the rest of the columns.
+# Adapters are registered by name with @register_format and selected per workbook (Read_Excel_Input(..., sheet_format=...))
+# or per sheet (optional 'format' column in metadata).
+#
+# For Read_Excel_Input(..., streaming=True), the same name is looked up in ROW_FORMATS, whose adapters work on the heading
+# and the rows of a sheet (tuples of cell values) instead of a DataFrame, and return the heading with 'item' first
+# (left as is when the item column is not found) and the rows as (raw_item, raw_values).
+FORMATS = dict()
+ROW_FORMATS = dict()
+
+# placeholders that some sources use instead of leaving a cell empty
+EMPTY_VALUES = ['-', '—', '–', '']
+
+
+def register_format(name):
+    """
+    decorator to register a format adapter under name
+    """
+    def decorator(adapter):
+        FORMATS[name] = adapter
+        return adapter
+    return decorator
+
+
+def register_row_format(name):
+    """
+    decorator to register a streaming (row) format adapter under name
+    """
+    def decorator(adapter):
+        ROW_FORMATS[name] = adapter
+        return adapter
+    return decorator
+
+
+def clean_rows(header, rows, sheet_format, metadata_row):
+    """
+    streaming counterpart of clean_sheet(): takes the heading and the rows of a sheet (as read by pd.read_excel, i.e. 
+    empty headings are 'Unnamed: n' and rows are as wide as the heading) and returns (header, rows) where header is 
+    ['item'] + periods and rows yields (raw_item, raw_values) for each item
+    """
+    if sheet_format not in ROW_FORMATS:
+        raise ValueError(f"Unknown format '{sheet_format}' for streaming. Registered formats are {list(ROW_FORMATS)}")
+    return ROW_FORMATS[sheet_format](header, rows, metadata_row)
+
+
+def clean_sheet(data_df, sheet_format, metadata_row):
+    """
+    cleans a sheet with the adapter registered under sheet_format
+    """
+    if sheet_format not in FORMATS:
+        raise ValueError(f"Unknown format '{sheet_format}'. Registered formats are {list(FORMATS)}")
+    return FORMATS[sheet_format](data_df, metadata_row)
+
+
 def clean_column_headings(data_df):
     """
-    THIS FUNCTION'S IMPLEMENTATION MAY VARY DEPENDING ON SOURCE
-    
     MAKES FIRST COLUMN'S NAME TO BE 'item'
-    
+
     for Samchully
     change 'Unnamed: 0' to 'item' in the heading
     """
-    df = data_df.copy()
-    column_headings = df.columns.tolist()
-    if column_headings[0] == 'Unnamed: 0':
-        column_headings[0] = 'item'
-        df.columns = column_headings
+    if len(data_df.columns) and data_df.columns[0] == 'Unnamed: 0':
+        return data_df.rename(columns={'Unnamed: 0': 'item'}, copy=False)
+    return data_df
+
+
+def detect_header(data_df):
+    """
+    if the first row of the sheet was not the heading (i.e. all the headings are 'Unnamed: n'),
+    uses the first row where all the period columns are filled in as the heading
+    """
+    if not len(data_df.columns) or not data_df.columns.astype(str).str.startswith('Unnamed: ').all():
+        return data_df
+
+    is_filled = data_df.iloc[:, 1:].notna().all(axis=1)
+    if not is_filled.any():
+        return data_df
+    header_row = is_filled.values.argmax()
+    df = data_df.iloc[header_row + 1:]
+    df.columns = ['Unnamed: 0'] + data_df.iloc[header_row, 1:].tolist()
+    return df
+
+
+def detect_item_column(data_df):
+    """
+    renames the first column that mostly holds text to 'item' and moves it to the front
+    """
+    for column in data_df.columns:
+        values = data_df[column].dropna()
+        if len(values) and (values.map(type) == str).mean() > 0.5:
+            break
+    else:
+        return data_df
+
+    df = data_df.rename(columns={column: 'item'}, copy=False)
+    if df.columns[0] != 'item':
+        df = df[['item'] + [x for x in df.columns if x != 'item']]
+    return df
+
+
+def coerce_values(data_df, scale=1):
+    """
+    converts text columns (e.g. numbers mixed with '-') to numbers and multiplies values by scale
+
+    EMPTY_VALUES are always turned into NaN; any other text is left as is (in its cell) so that 
+    Read_Excel_Input.validate_raw_data() reports it
+    """
+    columns = dict()
+    for period in data_df.columns[1:]:
+        values = data_df[period]
+        if values.dtype == object:
+            values = values.replace(EMPTY_VALUES, np.nan)
+            converted = pd.to_numeric(values, errors='coerce') * scale
+            is_text = converted.isna() & values.notna()
+            columns[period] = converted.astype(object).where(~is_text, values) if is_text.any() else converted
+        elif scale != 1:
+            columns[period] = values * scale
+
+    if not columns:
+        return data_df
+    # shallow copy: only the converted columns are replaced, the rest of the sheet is not copied
+    df = data_df.copy(deep=False)
+    for period, values in columns.items():
+        df[period] = values
     return df
+
+
+def coerce_row_values(raw_values, scale=1):
+    """
+    streaming counterpart of coerce_values() for the cells of one sheet (2d object array, items x periods):
+    returns (values, is_non_numeric) where values is a float array with NaN for empty cells and non-numeric text
+    """
+    cells = raw_values.ravel()
+    is_empty = pd.isna(cells) | np.isin(cells, EMPTY_VALUES)
+    values = pd.to_numeric(np.where(is_empty, np.nan, cells), errors='coerce').astype(float)
+    is_non_numeric = np.isnan(values) & ~is_empty
+    if scale != 1:
+        values = values * scale
+    return values.reshape(raw_values.shape), is_non_numeric.reshape(raw_values.shape)
+
+
+def get_scale(metadata_row):
+    """
+    optional 'scale' column in metadata (e.g. 1000 when values are reported in thousands)
+    """
+    scale = metadata_row.get('scale', 1)
+    return 1 if pd.isna(scale) else scale
+
+
+@register_format('samchully')
+def samchully(data_df, metadata_row):
+    """
+    Samchully (DART): 'Unnamed: 0' holds items, periods are headings such as '제 57 기', values are numbers
+    """
+    df = clean_column_headings(data_df)
+    return coerce_values(df, scale=get_scale(metadata_row))
+
+
+@register_format('tsmc')
+def tsmc(data_df, metadata_row):
+    """
+    TSMC: years as (integer) headings, '-' for zero and blank rows between sections
+    """
+    df = detect_item_column(detect_header(data_df)).rename(columns=str, copy=False)
+    if 'item' not in df.columns:
+        # e.g. an empty sheet: reported as missing item column by Read_Excel_Input.validate_raw_data()
+        return df
+
+    # drop blank rows between sections
+    is_blank = df['item'].isna() & df.iloc[:, 1:].isna().all(axis=1)
+    if is_blank.any():
+        df = df[~is_blank]
+    return coerce_values(df, scale=get_scale(metadata_row))
+
+
+@register_row_format('samchully')
+def samchully_rows(header, rows, metadata_row):
+    """
+    Samchully (DART), streaming: as in clean_column_headings(), only a first column without heading ('Unnamed: 0') holds items
+    """
+    if header and header[0] == 'Unnamed: 0':
+        header = ['item'] + list(header[1:])
+    return header, ((row[0], row[1:]) for row in rows)
+
+
+@register_row_format('tsmc')
+def tsmc_rows(header, rows, metadata_row):
+    """
+    TSMC, streaming: the first column holds items (the heading must be the first row), years in the heading are turned 
+    into text and blank rows between sections are dropped as in tsmc()
+    """
+    if header:
+        header = ['item'] + [str(x) for x in header[1:]]
+    return header, ((row[0], row[1:]) for row in rows if any(x is not None for x in row))
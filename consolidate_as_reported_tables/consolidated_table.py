@@ -1,3 +1,9 @@
+import os
+import pickle
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 import pandas as pd
 import numpy as np
 from fuzzywuzzy import fuzz
@@ -8,6 +14,53 @@ from openpyxl.styles import PatternFill, NamedStyle
 from colorama import Fore, Back, Style
 
 
+# a search is only sent to the process pool when it may try at least this many combinations in total
+# (number of targets x 2 ** number of candidates): about 6 seconds of serial search, measured at ~6 microseconds per 
+# combination, against 2-3 seconds to start a pool of 4 workers that re-import pandas on spawn platforms (macOS/Windows)
+PARALLEL_MIN_COMBINATIONS = 1 << 20
+
+
+def _find_first_combination(target, candidate_values):
+    """
+    Helper function for apply_combinations_to_match(): subset-sum search for a single target
+    
+    - target (ndarray): overlapping_periods values of the item to be matched, shape (n_periods,)
+    - candidate_values (ndarray): overlapping_periods values of the candidates, shape (n_periods, n_candidates)
+    
+    returns the first combination (in itertools.combinations order) of 2 or more candidate positions 
+    whose sum equals target, or None if there is none.
+    It is a module-level function so that it can be pickled to worker processes.
+    """
+    n_candidates = candidate_values.shape[1]
+    for x in chain.from_iterable(combinations(range(n_candidates), r) for r in range(2, n_candidates + 1)):
+        if (candidate_values[:, list(x)].sum(axis=1) == target).all():
+            return x
+    return None
+
+
+def _hash_df(df):
+    """
+    Helper function for Consolidated_Table._fingerprint_inputs(): content hash of a DataFrame (column names and values)
+    """
+    h = hashlib.sha256(repr(df.columns.tolist()).encode())
+    if len(df):
+        h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return h.hexdigest()
+
+
+def _drop_zeros(values):
+    """
+    Helper function for Consolidated_Table.base_values: keeps only the non-zero (and non-NaN) values of a Series
+    """
+    return values[values.notna() & (values != 0)]
+
+
+# attributes that are saved after each source and restored when resuming from a checkpoint
+CHECKPOINT_ATTRIBUTES = [
+    'comp_source', 'overlapping_periods', 'comp_only_periods', 'base_only_periods', 'df',
+    'base_rows', 'base_values', '_next_row_id', 'items', 'logger', 'combination_rules', 'comp_items_to_map']
+
+
 class Consolidated_Table:  
     """
     - irreconcilable (bool)
@@ -15,20 +68,32 @@ class Consolidated_Table:
     - comp_like_df (DataFrame)
     - manual_mapping_rules (dict)
     - items
-    - data (DataFrame): copy of rei.data; used to yield df_long, which produces updated df at the beginning of iteration
+    - data (DataFrame): copy of rei.data; each source's rows are moved over to df at the beginning of iteration
     - logger
     - sources_to_consolidate (list): list of sources waiting to be consolidated
-    - df_long (DataFrame): long form of df that are already consolidated; used only temporarily to produce updated df at the beginning of iteration
-    - df    
+    - base_rows (DataFrame): one row per item that is already consolidated (row_id, source, row_num, item, raw_item)
+    - base_values (dict): period -> Series of values indexed by row_id; only holds non-zero cells, missing cells are zero
+    - df: base and comp rows for the periods of the current source only (overlapping_periods + comp_only_periods);
+        the full table across all periods is only built once, after the last source
     - comp_source (str): current source being consolidated, short for "comparison source"
     - overlapping_periods (list): periods where base and comp overlap
     - comp_only_periods (list): periods only comp applies
     - base_only_periods (list): periods only base applies
     - combination_rules    
+    - n_jobs (int): number of worker processes for the searches in apply_combinations_to_match; defaults to 1 (no process pool).
+        The pool is started on the first large search and reused until the last source is consolidated
+    - state_dir (str): directory where a checkpoint is saved after each source; when given, consolidation resumes 
+        from the last checkpoint whose inputs have not changed
+    - inputs (dict): fingerprints of the inputs (sheets, comp_like, item_manual_mappings, irreconcilable) in metadata order
+    - comp_items_to_map (set): comp items seen by manually_map_items so far, including the items they were mapped to; 
+        used to tell which sources a change in item_manual_mappings applies to
     """      
-    def __init__(self, rei, output_excel_file, irreconcilable):
+    def __init__(self, rei, output_excel_file, irreconcilable, n_jobs=None, state_dir=None):
         self.irreconcilable = irreconcilable
         self.output_excel_file = output_excel_file
+        self.n_jobs = n_jobs or 1
+        self._executor = None
+        self.state_dir = state_dir
         
         # initialize attributes from rei
         self.comp_like_df = rei.comp_like_df.copy()
@@ -47,9 +112,20 @@ class Consolidated_Table:
         
         # prepare to iterate through sources
         self.sources_to_consolidate = rei.metadata_df['tab'].tolist()
+        self._data_by_source = {source: df for source, df in self.data.groupby('source', sort=False)}
         base_source = self.sources_to_consolidate.pop(0)
-        self.df_long = self.data[self.data['source'] == base_source].copy()
-        self.df_long.loc[:, 'record_type'] = 'base'
+        base_long = self._data_by_source[base_source]
+        
+        self.base_rows = base_long.drop_duplicates(subset=['row_num'])[['source', 'row_num', 'item', 'raw_item']] \
+            .sort_values(by='row_num') \
+            .reset_index(drop=True)
+        self.base_rows.insert(0, 'row_id', np.arange(len(self.base_rows)))
+        self._next_row_id = len(self.base_rows)
+        
+        row_id_by_row_num = self.base_rows.set_index('row_num')['row_id']
+        self.base_values = {
+            period: pd.Series(grp['value'].values, index=row_id_by_row_num.loc[grp['row_num']].values).pipe(_drop_zeros)
+            for period, grp in base_long.groupby('period', sort=False)}
         
         self.df = None
         self.comp_source = None
@@ -58,6 +134,100 @@ class Consolidated_Table:
         self.base_only_periods = None
 
         self.combination_rules = []
+        
+        # base_only_periods values for comp rows, set when a comp row is matched to a combination of base rows
+        self.comp_base_only_values = dict()
+        
+        self.comp_items_to_map = set()
+        self.inputs = self._fingerprint_inputs(rei)
+        if self.state_dir:
+            self._resume_from_checkpoint()
+            
+    def _fingerprint_inputs(self, rei):
+        """
+        helper function to fingerprint everything that the consolidation of each source depends on
+        """
+        tabs = rei.metadata_df['tab'].tolist()
+        return {
+            'irreconcilable': self.irreconcilable,
+            'manual_mapping_rules': getattr(self, 'manual_mapping_rules', {}),
+            'tabs': tabs,
+            # hashed from the long-format data so that it does not depend on how the sheets were read (e.g. streaming)
+            'sheets': [_hash_df(self._data_by_source[tab][['period', 'row_num', 'raw_item', 'raw_value']]) 
+                       if tab in self._data_by_source else None for tab in tabs],
+            'comp_like': [_hash_df(self.comp_like_df.loc[self.comp_like_df['source'] == tab, ['raw_item']] \
+                                   .sort_values(by='raw_item', key=lambda x: x.astype(str))) for tab in tabs],
+        }
+    
+    def _checkpoint_file(self, i):
+        return os.path.join(self.state_dir, f'checkpoint_{i:03d}.pkl')
+    
+    def _is_checkpoint_valid(self, checkpoint_inputs):
+        """
+        helper function for _resume_from_checkpoint(): checks that none of the inputs the checkpoint depends on have changed
+        """
+        n = len(checkpoint_inputs['tabs'])
+        if checkpoint_inputs['irreconcilable'] != self.inputs['irreconcilable']:
+            return False
+        for key in ['tabs', 'sheets', 'comp_like']:
+            if checkpoint_inputs[key] != self.inputs[key][:n]:
+                return False
+            
+        # a manual mapping only applies to sources where item_from is among the comp items; 
+        # mappings are applied in order (e.g. X --> Y then Y --> Z), so their order matters too
+        comp_items_to_map = checkpoint_inputs['comp_items_to_map']
+        def applicable_rules(rules):
+            return [(item_from, item_to) for item_from, item_to in rules.items() if item_from in comp_items_to_map]
+        return applicable_rules(checkpoint_inputs['manual_mapping_rules']) == applicable_rules(self.inputs['manual_mapping_rules'])
+    
+    def _save_checkpoint(self):
+        """
+        saves the state after the current source into self.state_dir
+        """
+        if not self.state_dir:
+            return
+        os.makedirs(self.state_dir, exist_ok=True)
+        
+        i = self.inputs['tabs'].index(self.comp_source)
+        checkpoint_inputs = {key: self.inputs[key][:i + 1] for key in ['tabs', 'sheets', 'comp_like']}
+        checkpoint_inputs.update({
+            'irreconcilable': self.inputs['irreconcilable'],
+            'manual_mapping_rules': self.inputs['manual_mapping_rules'],
+            'comp_items_to_map': self.comp_items_to_map,
+        })
+        # inputs are dumped first so that they can be checked without loading the state
+        with open(self._checkpoint_file(i), 'wb') as f:
+            pickle.dump(checkpoint_inputs, f)
+            pickle.dump({key: getattr(self, key) for key in CHECKPOINT_ATTRIBUTES}, f)
+    
+    def _resume_from_checkpoint(self):
+        """
+        restores the latest valid checkpoint in self.state_dir so that only the sources from the first changed one onward are consolidated
+        """
+        tabs = self.inputs['tabs']
+        for i in range(len(tabs) - 1, 0, -1):
+            if not os.path.exists(self._checkpoint_file(i)):
+                continue
+            with open(self._checkpoint_file(i), 'rb') as f:
+                if not self._is_checkpoint_valid(pickle.load(f)):
+                    continue
+                state = pickle.load(f)
+            break
+        else:
+            return
+        
+        items = self.items
+        for key, value in state.items():
+            setattr(self, key, value)
+        # items of the sources yet to be consolidated come from the new input
+        self.items = pd.concat([self.items[self.items['source'].isin(tabs[:i + 1])], items[items['source'].isin(tabs[i + 1:])]],
+                               ignore_index=True)
+        self.sources_to_consolidate = tabs[i + 1:]
+        print(f"resumed from checkpoint after source={self.comp_source}, sources to consolidate: {self.sources_to_consolidate}")
+        
+        if not self.sources_to_consolidate:
+            print("No changes since the last run.")
+            self._export_consolidated_table()
             
     def _print_df_status(self):
         """
@@ -74,31 +244,39 @@ class Consolidated_Table:
             raise IOError("No more sources to consolidate!")
               
         self.comp_source = self.sources_to_consolidate.pop(0)
-        df_new_long = self.data[self.data['source'] == self.comp_source].copy()
+        df_new_long = self._data_by_source[self.comp_source].copy()
         df_new_long.loc[:, 'record_type'] = 'comp'
-        self.df_long = pd.concat([self.df_long, df_new_long])
-        self.df_long['value'] = self.df_long['value'].fillna(0)
+        df_new_long['value'] = df_new_long['value'].fillna(0)
+        
+        base_periods = list(self.base_values)
+        comp_periods = df_new_long['period'].unique()
+
+        self.overlapping_periods = list(set(base_periods) & set(comp_periods))
+        self.comp_only_periods = list(set(comp_periods) - set(base_periods)) 
+        self.base_only_periods = list(set(base_periods) - set(comp_periods)) 
+        
+        # only the periods of comp are laid out; base_only_periods stay in self.base_values until post_process_next_source()
+        period_columns = sorted(self.overlapping_periods + self.comp_only_periods)
+        base_df = self.base_rows.assign(record_type='base')
+        for period in period_columns:
+            if period in self.overlapping_periods:
+                base_df[period] = self.base_values[period].reindex(base_df['row_id']).fillna(0).values
+            else:
+                base_df[period] = np.nan
         
         # raw_value is dropped 
-        self.df = self.df_long.pivot(
+        comp_df = df_new_long.pivot(
                 index=['source', 'record_type','row_num', 'item', 'raw_item'],
                 columns='period', values='value') \
-            .reset_index() \
+            .reset_index()
+        comp_df.columns.name = None
+
+        # row_id of comp rows is filled in with the row_id of their base row when a pair is matched with ffill()/bfill()
+        self.df = pd.concat([base_df, comp_df], ignore_index=True) \
+            [['source', 'record_type', 'row_num', 'item', 'raw_item'] + period_columns + ['row_id']] \
             .sort_values(by=['record_type','row_num']) \
             .assign(matched=False, disjoint='NA', init_row_num=lambda x: x['row_num'], init_comp_row_num=-1)
-        self.df.columns.name = None
-
-        self.overlapping_periods = list(
-            set(self.df_long[self.df_long['record_type'] == 'base']['period'].unique()) & \
-            set(self.df_long[self.df_long['record_type'] == 'comp']['period'].unique()))
-
-        self.comp_only_periods = list(
-            set(self.df_long[self.df_long['record_type'] == 'comp']['period'].unique()) - \
-            set(self.df_long[self.df_long['record_type'] == 'base']['period'].unique())) 
-    
-        self.base_only_periods = list(
-            set(self.df_long[self.df_long['record_type'] == 'base']['period'].unique()) - \
-            set(self.df_long[self.df_long['record_type'] == 'comp']['period'].unique())) 
+        self.comp_base_only_values = dict()
         
         msg = f"start consolidating source={self.comp_source}:"
         print(msg)
@@ -173,102 +351,145 @@ class Consolidated_Table:
             self.df.loc[unmatched_df.index] = unmatched_df
         self._print_df_status()
 
+    def _get_rows_by_item(self, record_type):
+        """
+        helper function to look up rows by item instead of masking the whole self.df: item -> positions (in self.df order) of the rows of record_type
+        """
+        positions = np.flatnonzero((self.df['record_type'] == record_type).values)
+        return {item: positions[x] for item, x in pd.Series(positions).groupby(self.df['item'].values[positions]).indices.items()}
+
     def manually_map_items(self):
+        # recorded so that a later change in item_manual_mappings only invalidates the checkpoints it applies to
+        self.comp_items_to_map |= set(self.df.loc[self.df['record_type'] == 'comp', 'item'])
+        
         if not self.irreconcilable:
             return
         
         print('\n3. manually map inconsistent items...')
         
+        # Note: (~self.df['matched']) is not a condition
+        comp_rows_by_item = self._get_rows_by_item('comp')
+        base_rows_by_item = self._get_rows_by_item('base')
+        items = self.df['item'].to_numpy(copy=True)
+        init_row_nums = self.df['init_row_num'].to_numpy()
+        init_comp_row_nums = self.df['init_comp_row_num'].to_numpy(copy=True)
+        comp_only_values = self.df[self.comp_only_periods].to_numpy(dtype=float).T.copy()
+        # name in self.items -> name it is mapped to, applied to self.items once after the loop
+        renames = dict()
+        
+        # mappings are applied in order, so that an item mapped by one rule can be mapped again by a later rule
         for item_from, item_to in self.manual_mapping_rules.items():
-            # Note: (~self.df['matched']) is not a condition
-            is_item_from_row = (self.df['record_type'] == 'comp') & (self.df['item'] == item_from)
-            is_item_to_row = (self.df['record_type'] == 'base') & (self.df['item'] == item_to)
-            
-            if not is_item_from_row.any() or not is_item_to_row.any(): 
+            if item_from not in comp_rows_by_item or item_to not in base_rows_by_item: 
                 continue
+            item_from_rows = comp_rows_by_item.pop(item_from)
+            item_to_rows = base_rows_by_item[item_to]
+            # item_to becomes a comp item too, so a later rule can map it again (e.g. X --> Y then Y --> Z)
+            self.comp_items_to_map.add(item_to)
                     
             # we don't check whether values of overlapping_periods are consistent because it won't be.
             
-            # update self.items
-            self.items.loc[(self.items['source'] == self.comp_source) & (self.items['name'] == item_from), 'name'] = item_to
+            # update renames for self.items; names already mapped to item_from follow it to item_to
+            renames.update({name: item_to for name, mapped_to in renames.items() if mapped_to == item_from})
+            renames.setdefault(item_from, item_to)
 
             # update self.df
             # fill NA values in base from comp
-            self.df.loc[is_item_to_row, self.comp_only_periods] = self.df.loc[is_item_from_row, self.comp_only_periods].sum().values
+            comp_only_values[:, item_to_rows] = np.nansum(comp_only_values[:, item_from_rows], axis=1)[:, None]
 
             # writes the min init_row_num to init_comp_row_num
-            self.df.loc[is_item_to_row, 'init_comp_row_num'] = self.df.loc[is_item_from_row, 'init_row_num'].min()
+            init_comp_row_nums[item_to_rows] = init_row_nums[item_from_rows].min()
             
-            self.df.loc[is_item_from_row, 'item'] = self.df.loc[is_item_to_row, 'item'].values
+            items[item_from_rows] = items[item_to_rows]
+            comp_rows_by_item[item_to] = np.sort(np.concatenate([comp_rows_by_item.get(item_to, item_from_rows[:0]), item_from_rows]))
             
-            # self.df.loc[is_item_to_row, 'matched'] = True
-            # self.df.loc[is_item_from_row, 'matched'] = True   
             msg = f" manually map inconsistent items applied: {item_from} --> {item_to}"
             print(msg)
             self.logger.append((self.comp_source, msg))
+        
+        self.df['item'] = items
+        self.df['init_comp_row_num'] = init_comp_row_nums
+        if self.comp_only_periods:
+            self.df[self.comp_only_periods] = comp_only_values.T
+        if renames:
+            is_comp_item = self.items['source'] == self.comp_source
+            self.items.loc[is_comp_item, 'name'] = [renames.get(name, name) for name in self.items.loc[is_comp_item, 'name']]
     
         self._print_df_status()
 
     def apply_combination_rules(self):
         print('\n4. apply combination rules...')
-                        
-        for x in self.combination_rules:
-            base_tuple_mask = (self.df['item'].isin(x['base_tuple'])) & (self.df['record_type']=='base')
-            comp_tuple_mask = (self.df['item'].isin(x['comp_tuple'])) & (self.df['record_type']=='base')
-            
-            # since we are keeping track of duplicated items, we expect none or 1 items to be matched by this step, but not both
-            if self.df[comp_tuple_mask]['matched'].all() and self.df[base_tuple_mask]['matched'].all():
-                raise ValueError(f"both comp_tuple: {x['comp_tuple']} and base_tuple: {x['base_tuple']} are already matched")
-                                      
-            # case when base_tuple is 1 and comp_tuple is more than 1
-            if base_tuple_mask.sum() == 1:
-                # comp_tuple is matched in previous steps
-                if self.df[comp_tuple_mask]['matched'].all():
-                    if (self.df.loc[base_tuple_mask, self.overlapping_periods].sum().values == self.df.loc[comp_tuple_mask, self.overlapping_periods].sum().values).all():
-                        self.df.loc[base_tuple_mask, self.comp_only_periods] =  self.df.loc[comp_tuple_mask, self.comp_only_periods].sum().values
-                        x['sources'].append(self.comp_source) 
-                        self.df.loc[base_tuple_mask, 'matched'] = True
-                        msg = f'rule applied and {x["base_tuple"]} copied over: {x}'
+        
+        # rows of each rule are looked up by item; both base_tuple and comp_tuple are in base by now
+        base_rows_by_item = self._get_rows_by_item('base')
+        no_rows = np.array([], dtype=int)
+        def get_rows(items):
+            rows = [base_rows_by_item[item] for item in items if item in base_rows_by_item]
+            return np.sort(np.concatenate(rows)) if rows else no_rows
+        
+        matched = self.df['matched'].to_numpy(dtype=bool, copy=True)
+        overlapping_values = self.df[self.overlapping_periods].to_numpy(dtype=float).T.copy()
+        comp_only_values = self.df[self.comp_only_periods].to_numpy(dtype=float).T.copy()
+        
+        # (rule, bookkeeping list to append comp_source to, message) in order; bookkeeping and logging are done in bulk at the end
+        outcomes = []
+        try:
+            for x in self.combination_rules:
+                base_tuple_rows = get_rows(x['base_tuple'])
+                comp_tuple_rows = get_rows(x['comp_tuple'])
+                
+                # since we are keeping track of duplicated items, we expect none or 1 items to be matched by this step, but not both
+                if matched[comp_tuple_rows].all() and matched[base_tuple_rows].all():
+                    raise ValueError(f"both comp_tuple: {x['comp_tuple']} and base_tuple: {x['base_tuple']} are already matched")
+                
+                # case when base_tuple is 1 and comp_tuple is more than 1
+                if len(base_tuple_rows) == 1:
+                    # comp_tuple is matched in previous steps
+                    if matched[comp_tuple_rows].all():
+                        if (np.nansum(overlapping_values[:, base_tuple_rows], axis=1) == np.nansum(overlapping_values[:, comp_tuple_rows], axis=1)).all():
+                            comp_only_values[:, base_tuple_rows] = np.nansum(comp_only_values[:, comp_tuple_rows], axis=1)[:, None]
+                            matched[base_tuple_rows] = True
+                            outcomes.append((x, 'sources', f'rule applied and {x["base_tuple"]} copied over'))
+                        else:
+                            outcomes.append((x, 'invalid_sources', 'rule invalid'))
+                    
+                    # base_tuple is matched in previous steps
+                    elif matched[base_tuple_rows].all():
+                        matched[comp_tuple_rows] = True
+                        outcomes.append((x, 'sources', 'rule applied'))
                     else:
-                        x['invalid_sources'].append(self.comp_source)
-                        msg = f'rule invalid: {x}'
-                        
-                # base_tuple is matched in previous steps
-                elif self.df[base_tuple_mask]['matched'].all():
-                    self.df.loc[comp_tuple_mask, 'matched'] = True 
-                    x['sources'].append(self.comp_source) 
-                    msg = f'rule applied: {x}'
-                else:
-                    msg = f'rule irrelevant: {x}'
-                    # self.df.loc[base_tuple_mask, 'matched'] = True 
-                    # self.df.loc[comp_tuple_mask, 'matched'] = True 
+                        outcomes.append((x, None, 'rule irrelevant'))
+                
+                # case when base_tuple is more than 1 and comp_tuple is 1
+                elif len(comp_tuple_rows) == 1:
+                    # comp_tuple is matched in previous steps
+                    if matched[comp_tuple_rows].all():
+                        matched[base_tuple_rows] = True
+                        outcomes.append((x, 'sources', 'rule applied'))
                     
-            # case when base_tuple is more than 1 and comp_tuple is 1
-            elif comp_tuple_mask.sum() == 1:
-                # comp_tuple is matched in previous steps
-                if self.df[comp_tuple_mask]['matched'].all():
-                    self.df.loc[base_tuple_mask, 'matched'] = True    
-                    x['sources'].append(self.comp_source)
-                    msg = f'rule applied: {x}'
-                     
-                # base_tuple is matched in previous steps
-                elif self.df[base_tuple_mask]['matched'].all():
-                    if (self.df.loc[base_tuple_mask, self.overlapping_periods].sum().values == self.df.loc[comp_tuple_mask, self.overlapping_periods].sum().values).all():
-                        self.df.loc[comp_tuple_mask, self.comp_only_periods] =  self.df.loc[base_tuple_mask, self.comp_only_periods].sum().values
-                        x['sources'].append(self.comp_source) 
-                        self.df.loc[comp_tuple_mask, 'matched'] = True 
-                        msg = f'rule applied and {x["comp_tuple"]} copied over: {x}'
+                    # base_tuple is matched in previous steps
+                    elif matched[base_tuple_rows].all():
+                        if (np.nansum(overlapping_values[:, base_tuple_rows], axis=1) == np.nansum(overlapping_values[:, comp_tuple_rows], axis=1)).all():
+                            comp_only_values[:, comp_tuple_rows] = np.nansum(comp_only_values[:, base_tuple_rows], axis=1)[:, None]
+                            matched[comp_tuple_rows] = True
+                            outcomes.append((x, 'sources', f'rule applied and {x["comp_tuple"]} copied over'))
+                        else:
+                            outcomes.append((x, 'invalid_sources', 'rule invalid'))
                     else:
-                        x['invalid_sources'].append(self.comp_source)
-                        msg = f'rule invalid: {x}'
+                        outcomes.append((x, None, 'rule irrelevant'))
                 else:
-                    msg = f'rule irrelevant: {x}'
-                    # self.df.loc[base_tuple_mask, 'matched'] = True 
-                    # self.df.loc[comp_tuple_mask, 'matched'] = True               
-            else:
-                raise ValueError("M:M mapping between comp_tuples and base_tuples not allowed")            
-            print(msg)
-            self.logger.append((self.comp_source, msg))
+                    raise ValueError("M:M mapping between comp_tuples and base_tuples not allowed")
+        finally:
+            self.df['matched'] = matched
+            if self.comp_only_periods:
+                self.df[self.comp_only_periods] = comp_only_values.T
+            
+            for x, sources_key, _ in outcomes:
+                if sources_key:
+                    x[sources_key].append(self.comp_source)
+            for x, _, msg in outcomes:
+                msg = f'{msg}: {x}'
+                print(msg)
+                self.logger.append((self.comp_source, msg))
     
     def designate_disjoint_items(self):
         print('\n6a. set aside disjoint items...')
@@ -293,6 +514,44 @@ class Consolidated_Table:
             self.df.loc[(self.df['item'] == item) & (self.df['record_type']=='base') , 'init_comp_row_num'   ] = self.df.loc[(self.df['item'] == item) & (self.df['record_type']=='comp') , 'init_row_num'        ].min()
             self.df.loc[self.df['item'] == item , 'matched'] = True
     
+    def _search_combinations(self, target_items, target_record_type, candidate_mask):
+        """
+        helper function for apply_combinations_to_match(): for each item in target_items, finds the first combination of
+        2 or more candidate rows (in the order they appear in self.df) whose overlapping_periods sum equals that of the item.
+        
+        The searches only read self.df and are independent of one another, so they are run in a process pool
+        (one task per target, batched by chunksize) when there is enough work. Results come back in the order of 
+        target_items so that they are committed exactly as in a serial run.
+        """
+        if not target_items:
+            return []
+        
+        # (n_periods, n_candidates) layout so that a combination is summed over contiguous values like DataFrame.sum()
+        candidate_values = np.ascontiguousarray(
+            self.df.loc[candidate_mask, self.overlapping_periods].fillna(0).to_numpy(dtype=float).T)
+        target_rows = self.df[self.df['record_type'] == target_record_type]
+        targets = [target_rows.loc[target_rows['item'] == item, self.overlapping_periods].sum().to_numpy(dtype=float) 
+                   for item in target_items]
+        
+        search = partial(_find_first_combination, candidate_values=candidate_values)
+        n_combinations = len(targets) * 2 ** candidate_values.shape[1]
+        if self.n_jobs <= 1 or len(targets) <= 1 or n_combinations < PARALLEL_MIN_COMBINATIONS:
+            return [search(target) for target in targets]
+        
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.n_jobs)
+        print(f" searching {len(targets)} {target_record_type} items over {self.n_jobs} processes...")
+        # map() yields in submission order, which keeps the output deterministic
+        return list(self._executor.map(search, targets, chunksize=max(1, len(targets) // (4 * self.n_jobs))))
+    
+    def _shutdown_executor(self):
+        """
+        helper function to stop the worker processes of _search_combinations() once there is no more source to consolidate
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+    
     def apply_combinations_to_match(self):
         print('\n5. apply combinations to match...')
         
@@ -339,15 +598,10 @@ class Consolidated_Table:
                     raise ValueError(msg)
 
         compatiable_comp_items = {k: [] for k in unmatched_base_list}
-        for base_item in unmatched_base_list:
-            # print(f"look at base_item: {base_item}")
-            base_row = self.df[(self.df['item'] == base_item) & (self.df['record_type'] == 'base')]
-            for x in chain.from_iterable(combinations(unmatched_comp_list, r) for r in range(2, len(unmatched_comp_list) + 1)):
-                comp_rows = self.df[(self.df['item'].isin(x)) & (self.df['record_type'] == 'comp')]
-                if (base_row[self.overlapping_periods].sum() == comp_rows[self.overlapping_periods].sum()).all():
-                    compatiable_comp_items.setdefault(base_item, []).append(x)
-                    break # on finding the first match, we break
-                
+        found = self._search_combinations(unmatched_base_list, 'base', unmatched_comp_mask)
+        for base_item, x in zip(unmatched_base_list, found):
+            if x is not None:
+                compatiable_comp_items[base_item].append(tuple(unmatched_comp_list[i] for i in x))
                 
         # check compatiable_comp_items and add to new_rules
         for base_item, comp_items in compatiable_comp_items.items():
@@ -397,13 +651,10 @@ class Consolidated_Table:
         
           
         compatiable_base_items = {k: [] for k in unmatched_comp_list}
-        for comp_item in unmatched_comp_list:
-            comp_row = self.df[(self.df['item'] == comp_item) & (self.df['record_type'] == 'comp')]
-            for x in chain.from_iterable(combinations(unmatched_base_list, r) for r in range(2, len(unmatched_base_list) + 1)):
-                base_rows = self.df[(self.df['item'].isin(x)) & (self.df['record_type'] == 'base')]
-                if (comp_row[self.overlapping_periods].sum() == base_rows[self.overlapping_periods].sum()).all():
-                    compatiable_base_items.setdefault(comp_item, []).append(x)
-                    break # on finding the first match, we break
+        found = self._search_combinations(unmatched_comp_list, 'comp', unmatched_base_mask)
+        for comp_item, x in zip(unmatched_comp_list, found):
+            if x is not None:
+                compatiable_base_items[comp_item].append(tuple(unmatched_base_list[i] for i in x))
                 
         # check compatiable_base_items and add to new_rules
         for comp_item, base_items in compatiable_base_items.items():
@@ -431,7 +682,8 @@ class Consolidated_Table:
             is_comp_row = (self.df['item'] == comp_item) & (self.df['record_type'] == 'comp')
             
             self.df.loc[is_comp_row, 'item'] = self.df.loc[is_comp_row, 'item'] + ' [[1]]'
-            self.df.loc[is_comp_row, self.base_only_periods] = self.df.loc[is_base_row, self.base_only_periods].sum().values
+            self.comp_base_only_values[self.df.loc[is_comp_row, 'init_row_num'].iloc[0]] = \
+                self._get_base_only_values(self.df.loc[is_base_row, 'row_id']).sum()
             # self.df.loc[is_comp_row, 'matched'] = True
             self.df.loc[is_comp_row, 'disjoint'] = 'comp_like'
             
@@ -495,6 +747,56 @@ class Consolidated_Table:
             raise ValueError(f"There are still {((~self.df['matched']) & (self.df['disjoint'] != 'NA')).sum()} disjoint items left")
         self._print_df_status()
        
+    def _get_base_only_values(self, row_ids):
+        """
+        helper function to look up self.base_only_periods values of base rows, in the order of row_ids
+        """
+        return pd.DataFrame(
+            {period: self.base_values[period].reindex(row_ids).fillna(0).values for period in self.base_only_periods},
+            columns=self.base_only_periods)
+    
+    def _update_base_values(self, is_new_row):
+        """
+        helper function for post_process_next_source(): stores the values of base rows in self.df into self.base_values
+        
+        returns a boolean Series (aligned with self.df) of the new rows that were given base_only_periods values
+        """
+        # comp periods are overwritten for all base rows
+        for period in self.overlapping_periods + self.comp_only_periods:
+            self.base_values[period] = _drop_zeros(self.df[period].set_axis(self.df['row_id'].values))
+        
+        # base_only_periods are only added for rows moved over from comp, either from a combination of base rows
+        # (apply_combinations_to_match) or from the base row they were matched with
+        new_rows = self.df.loc[is_new_row, ['init_row_num', 'ref_row_id', 'row_id']]
+        from_combination = new_rows['init_row_num'].isin(list(self.comp_base_only_values))
+        from_ref = ~from_combination & new_rows['ref_row_id'].notna()
+        has_base_only_values = (from_combination | from_ref).reindex(self.df.index, fill_value=False)
+        if not self.base_only_periods or not has_base_only_values.any():
+            return has_base_only_values
+        
+        new_values = pd.concat([
+            pd.DataFrame([self.comp_base_only_values[x] for x in new_rows.loc[from_combination, 'init_row_num']],
+                         index=new_rows.loc[from_combination, 'row_id'].values, columns=self.base_only_periods),
+            self._get_base_only_values(new_rows.loc[from_ref, 'ref_row_id']).set_axis(new_rows.loc[from_ref, 'row_id'].values)])
+        # one concat per period, and only for the periods where a new row has a non-zero value
+        for period, values in new_values.items():
+            values = _drop_zeros(values)
+            if len(values):
+                self.base_values[period] = pd.concat([self.base_values[period], values])
+        return has_base_only_values
+    
+    def _build_consolidated_df(self, is_new_row, has_base_only_values):
+        """
+        helper function for post_process_next_source(): lays out self.df across all periods after the last source
+        """
+        base_only_df = self._get_base_only_values(self.df['row_id']).set_axis(self.df.index)
+        # rows moved over from comp in the last iteration have no values for base_only_periods, 
+        # unless they were given some by _update_base_values()
+        base_only_df.loc[is_new_row & ~has_base_only_values, self.base_only_periods] = np.nan
+        
+        period_columns = sorted(self.overlapping_periods + self.comp_only_periods + self.base_only_periods)
+        return pd.concat([self.df, base_only_df], axis=1)[['source', 'record_type', 'row_num', 'item', 'raw_item'] + period_columns]
+        
     def _export_consolidated_table(self):
         # new_rules = self._get_new_rules()
         # for comp_tuples, base_tuples in new_rules.items():
@@ -513,37 +815,51 @@ class Consolidated_Table:
         if (~self.df['matched']).sum() != 0:
             raise ValueError("There are still unmatched rows...")
         
-        del self.df['matched']
-        del self.df['init_row_num']
-        del self.df['init_comp_row_num']
-        del self.df['disjoint']
-    
         self.df = self.df.sort_values(by=['record_type','row_num'])
         self.df = self.df[self.df['record_type'] == 'base'].copy()
-        self.df_long = self.df.melt(
-                id_vars=['source', 'record_type', 'row_num', 'item', 'raw_item'],
-                var_name='period',
-                value_name='value') \
-            .assign(raw_value=lambda x: x['value'])[['source', 'record_type', 'period', 'row_num', 'item', 'raw_item', 'value', 'raw_value']]
-        self.df_long['value'] = self.df_long['value'].fillna(0)
+        
+        # rows moved over from comp get a new row_id; their current row_id refers to the base row they were matched with (if any)
+        is_new_row = self.df['source'] == self.comp_source
+        self.df['ref_row_id'] = self.df['row_id'].where(is_new_row)
+        self.df.loc[is_new_row, 'row_id'] = np.arange(self._next_row_id, self._next_row_id + is_new_row.sum())
+        self.df['row_id'] = self.df['row_id'].astype(int)
+        self._next_row_id += is_new_row.sum()
+        
+        has_base_only_values = self._update_base_values(is_new_row)
+        self.base_rows = self.df[['row_id', 'source', 'row_num', 'item', 'raw_item']].reset_index(drop=True)
         
         # if there is no more source to consolidate, export results and return
         if not self.sources_to_consolidate:
+            self._shutdown_executor()
+            self.df = self._build_consolidated_df(is_new_row, has_base_only_values)
+            self._save_checkpoint()
             self._export_consolidated_table()
             return
+        
+        del self.df['matched']
+        del self.df['init_row_num']
+        del self.df['init_comp_row_num']
+        del self.df['disjoint']
+        del self.df['ref_row_id']
+        self._save_checkpoint()
         print(self.sources_to_consolidate)
         print("Done.")
 
     def consolidate_next_source(self):
-        self.prepare_next_source()
-        self.match_same_items()
-        self.match_same_overlapping_periods_values()
-        self.manually_map_items()
-        self.apply_combination_rules()
-        self.designate_disjoint_items()
-        self.apply_combinations_to_match()
-        self.apply_disjoint_items()
-        self.post_process_next_source()
+        try:
+            self.prepare_next_source()
+            self.match_same_items()
+            self.match_same_overlapping_periods_values()
+            self.manually_map_items()
+            self.apply_combination_rules()
+            self.designate_disjoint_items()
+            self.apply_combinations_to_match()
+            self.apply_disjoint_items()
+            self.post_process_next_source()
+        except BaseException:
+            # e.g. inconsistent data: the worker processes would otherwise live as long as self (or the traceback) does
+            self._shutdown_executor()
+            raise
 
     def debug_export_df(self, debug_file_name):     
         """
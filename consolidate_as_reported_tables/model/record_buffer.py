@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+from .record import Record
+
+
+class Record_Buffer:
+    """
+    growable columnar buffer of Records: one preallocated numpy array per field, doubled in size when full
+
+    used by Read_Excel_Input.stream_excel_input() to collect long-format records without a DataFrame (or Record) per cell or per sheet.
+    source, record_type and period are the same for many records, so they are stored as int32 codes into their labels;
+    raw_value is stored as float64 because only numbers are buffered
+    """
+    DTYPES = {
+        'source': np.int32,
+        'record_type': np.int32,
+        'period': np.int32,
+        'row_num': np.int64,
+        'item': object,
+        'raw_item': object,
+        'value': np.float64,
+        'raw_value': np.float64,
+    }
+    CODED_FIELDS = ['source', 'record_type', 'period']
+
+    def __init__(self, capacity=1 << 16):
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        """
+        (re)starts with an empty buffer of capacity records
+        """
+        self.size = 0
+        self.columns = {field: np.empty(capacity, dtype=self.DTYPES[field]) for field in Record._fields}
+        self.labels = {field: dict() for field in self.CODED_FIELDS}  # label -> code
+
+    def _reserve(self, n):
+        """
+        makes room for n more records
+        """
+        capacity = len(self.columns['row_num'])
+        if self.size + n <= capacity:
+            return
+        while capacity < self.size + n:
+            capacity *= 2
+        for field, array in self.columns.items():
+            new_array = np.empty(capacity, dtype=array.dtype)
+            new_array[:self.size] = array[:self.size]
+            self.columns[field] = new_array
+
+    def _encode(self, field, values):
+        """
+        returns the code(s) of a label or an array of labels of a coded field, registering new labels
+        """
+        labels = self.labels[field]
+        if np.ndim(values) == 0:
+            return labels.setdefault(values, len(labels))
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        return np.array([labels.setdefault(x, len(labels)) for x in uniques], dtype=np.int32)[codes]
+
+    def extend(self, n, **values):
+        """
+        appends n records; each value is either a scalar (same for all n records) or an array of length n
+        """
+        self._reserve(n)
+        for field, value in values.items():
+            if field in self.labels:
+                value = self._encode(field, value)
+            self.columns[field][self.size:self.size + n] = value
+        self.size += n
+
+    def truncate(self, size):
+        """
+        drops the records from size onwards
+        """
+        for field in ('item', 'raw_item'):
+            self.columns[field][size:self.size] = None  # releases the objects
+        self.size = min(self.size, size)
+
+    def keep(self, start, mask):
+        """
+        keeps only the records from start onwards where mask (of length size - start) is True
+        """
+        n = int(np.count_nonzero(mask))
+        for array in self.columns.values():
+            array[start:start + n] = array[start:self.size][mask]
+        self.truncate(start + n)
+
+    def to_frame(self, categorical=()):
+        """
+        returns the records as a DataFrame with the same columns as pd.DataFrame(list_of_Records) and empties the buffer
+
+        - categorical (list): coded fields to return as pd.Categorical (e.g. record_type) instead of their labels
+
+        Columns are moved over one at a time (trimmed to size) so that the records are never held twice
+        """
+        df = pd.DataFrame(index=pd.RangeIndex(self.size))
+        for field in Record._fields:
+            values = self.columns.pop(field)[:self.size]
+            if field in self.labels:
+                # labels left unused by truncate() or keep() are dropped so that they do not change the dtype
+                is_used = np.zeros(len(self.labels[field]), dtype=bool)
+                is_used[np.unique(values)] = True
+                labels = pd.Index(list(self.labels[field]))[is_used]
+                values = (np.cumsum(is_used, dtype=np.int32) - 1)[values]
+                values = pd.Categorical.from_codes(values, labels) if field in categorical else labels.take(values).to_numpy()
+            else:
+                values = values.copy()
+            df[field] = values
+        self._allocate(capacity=1)
+        return df
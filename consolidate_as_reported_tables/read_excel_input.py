@@ -1,84 +1,300 @@
 import pandas as pd
 import numpy as np
+from itertools import islice
+from openpyxl import load_workbook
 
 from .model.record import Record
+from .model.record_buffer import Record_Buffer
 
 from . import clean_format  # custom clean format depending on the source
 
 
+def _get_width(row):
+    """
+    Helper function for Read_Excel_Input._stream_sheet(): number of cells up to the last one with a value
+    """
+    for i in range(len(row), 0, -1):
+        if row[i - 1] is not None:
+            return i
+    return 0
+
+
 class Read_Excel_Input:  
-    def __init__(self, input_excel_file):
+    # number of rows of a sheet read at once in streaming mode
+    STREAM_CHUNK_ROWS = 1024
+    
+    def __init__(self, input_excel_file, sheet_format='samchully', streaming=False):
         # Initialize attributes for reading from Excel
-        self.data_dfs = dict()
+        self.sheet_format = sheet_format  # default format adapter in clean_format, unless metadata has 'format' column
+        self.data_dfs = dict()  # stays empty when streaming
         self.metadata_df = pd.DataFrame()
         self.comp_like_df = pd.DataFrame(columns=['source', 'raw_item'])
         self.item_manual_mappings_df = pd.DataFrame(columns=['raw_item_from', 'raw_item_to', 'item_from', 'item_to'])
-        
-        # read excel input
-        self.read_excel_input(input_excel_file)
+        self.missing_tabs = list()
+        self.validation_report = pd.DataFrame(columns=['problem', 'source', 'row_num', 'item', 'period', 'value'])
         
         # Initialize attributes for processing raw data
-        self._raw_data = list()  # a list of Records
+        self._raw_data = list()  # a list of Records; stays empty when streaming
         self.items = pd.DataFrame(columns=['raw_name', 'source', 'name',]) \
             .astype({'raw_name': str, 'source': str, 'name': str})
         self.data = pd.DataFrame()      
         
+        if input_excel_file is None:
+            # nothing to read: the steps below can be called one by one (e.g. to get the validation report)
+            return
+        
+        if streaming:
+            # read, validate and initialize self.data sheet by sheet without keeping the sheets
+            self.stream_excel_input(input_excel_file)
+            return
+        
+        # read excel input
+        self.read_excel_input(input_excel_file)
+        
+        # validate raw data all at once, before processing it
+        self.validate_raw_data()
+        
         # process raw data and initialize self.data
         self.process_raw_data()
         self.initialize_data()
         
+    def _read_control_tabs(self, xls):
+        """
+        Helper function for read_excel_input() and stream_excel_input(): reads metadata, comp_like and item_manual_mappings
+        """
+        # read metadata
+        if 'metadata' in xls.sheet_names:
+            self.metadata_df = pd.read_excel(xls, sheet_name='metadata').astype({'tab': str})
+            missing_column = {'tab','name'} - set(self.metadata_df.columns)
+            if missing_column:
+                raise ValueError(f"metadata is missing columns {missing_column}.")
+        else:
+            raise ValueError("The input Excel file must contain metadata sheet.")
+            
+            
+        # read comp_like
+        if 'comp_like' in xls.sheet_names:
+            self.comp_like_df = pd.read_excel(xls, sheet_name='comp_like')
+            self.comp_like_df['source'] = self.comp_like_df['source'].astype(str)
+            missing_column = {'source', 'raw_item'} - set(self.comp_like_df.columns)
+            if missing_column:
+                raise ValueError(f"rules is missing columns {missing_column}.")
+                        
+        # read item_manual_mappings
+        if 'item_manual_mappings' in xls.sheet_names:
+            self.item_manual_mappings_df = pd.read_excel(xls, sheet_name='item_manual_mappings')
+            self.item_manual_mappings_df['item_from'] = self.item_manual_mappings_df['raw_item_from'].str.strip().str.lower()
+            self.item_manual_mappings_df['item_to'] = self.item_manual_mappings_df['raw_item_to'].str.strip().str.lower()
+            missing_column = {'raw_item_from', 'raw_item_to'} - set(self.item_manual_mappings_df.columns)
+            if missing_column:
+                raise ValueError(f"item_manual_mappings is missing columns {missing_column}.") 
+        
+        # missing sheets are reported by validation along with all other problems
+        self.missing_tabs = [tab for tab in self.metadata_df['tab'] if tab not in xls.sheet_names]
+    
+    def _get_sheet_format(self, metadata_row):
+        sheet_format = metadata_row.get('format', np.nan)
+        return self.sheet_format if pd.isna(sheet_format) else sheet_format
+        
     def read_excel_input(self, input_excel_file):
         """
-        reads excel file into "raw" data (i.e. self.data_dfs)
+        reads excel file into "raw" data (i.e. self.data_dfs), cleaning each sheet with its format adapter in clean_format
         """
         print(f"Reading Excel File: {input_excel_file}...")
         
         with pd.ExcelFile(input_excel_file) as xls:
-            # read metadata
-            if 'metadata' in xls.sheet_names:
-                self.metadata_df = pd.read_excel(xls, sheet_name='metadata').astype({'tab': str})
-                missing_column = {'tab','name'} - set(self.metadata_df.columns)
-                if missing_column:
-                    raise ValueError(f"metadata is missing columns {missing_column}.")
-            else:
-                raise ValueError("The input Excel file must contain metadata sheet.")
-                
-                
-            # read comp_like
-            if 'comp_like' in xls.sheet_names:
-                self.comp_like_df = pd.read_excel(xls, sheet_name='comp_like')
-                self.comp_like_df['source'] = self.comp_like_df['source'].astype(str)
-                missing_column = {'source', 'raw_item'} - set(self.comp_like_df.columns)
-                if missing_column:
-                    raise ValueError(f"rules is missing columns {missing_column}.")
-                            
-            # read item_manual_mappings
-            if 'item_manual_mappings' in xls.sheet_names:
-                self.item_manual_mappings_df = pd.read_excel(xls, sheet_name='item_manual_mappings')
-                self.item_manual_mappings_df['item_from'] = self.item_manual_mappings_df['raw_item_from'].str.strip().str.lower()
-                self.item_manual_mappings_df['item_to'] = self.item_manual_mappings_df['raw_item_to'].str.strip().str.lower()
-                missing_column = {'raw_item_from', 'raw_item_to'} - set(self.item_manual_mappings_df.columns)
-                if missing_column:
-                    raise ValueError(f"item_manual_mappings is missing columns {missing_column}.") 
+            self._read_control_tabs(xls)
                 
             # read sheets specified in metadata
             print("Reading sheets:", end=" ")
-            for sheet_name in self.metadata_df['tab']:
+            for metadata_row in self.metadata_df.to_dict('records'):
+                sheet_name = metadata_row['tab']
+                if sheet_name in self.missing_tabs:
+                    continue
                 print(f"{sheet_name}", end=" ")
-                self.data_dfs[sheet_name] = pd.read_excel(xls, sheet_name=sheet_name)
+                self.data_dfs[sheet_name] = clean_format.clean_sheet(
+                    pd.read_excel(xls, sheet_name=sheet_name), self._get_sheet_format(metadata_row), metadata_row)
             print()
+            
+    def stream_excel_input(self, input_excel_file):
+        """
+        streaming alternative to read_excel_input(), validate_raw_data(), process_raw_data() and initialize_data():
+        reads only the sheets in metadata row by row (openpyxl read-only) and emits their long-format records straight 
+        into a Record_Buffer, so that at most STREAM_CHUNK_ROWS rows of cells are held besides the records themselves.
+        
+        Note: the heading must be the first row of each sheet (no header detection), and cells beyond the dimension
+        that the sheet declares are ignored
+        """
+        print(f"Streaming Excel File: {input_excel_file}...")
+        
+        buffer = Record_Buffer()
+        items = {'source': [], 'row_num': [], 'item': []}  # raw items of every row, for validation
+        problems = []  # (problem, source, row_num, item, period, value)
+        new_items = {'raw_name': [], 'source': [], 'name': []}  # for self.items
+        workbook = load_workbook(input_excel_file, read_only=True, data_only=True)
+        with pd.ExcelFile(workbook, engine='openpyxl') as xls:
+            self._read_control_tabs(xls)
+            
+            print("Reading sheets:", end=" ")
+            for metadata_row in self.metadata_df.to_dict('records'):
+                sheet_name = metadata_row['tab']
+                if sheet_name in self.missing_tabs:
+                    continue
+                print(f"{sheet_name}", end=" ")
+                self._stream_sheet(workbook[sheet_name], metadata_row, buffer, items, problems, new_items)
+            print()
+        
+        self._report_problems(
+            pd.DataFrame(items), 
+            [pd.DataFrame(problems, columns=['problem', 'source', 'row_num', 'item', 'period', 'value'])])
+        
+        print('initializing self.data...')
+        self.data = buffer.to_frame(categorical=['record_type'])
+        self.data['record_type'] = self.data['record_type'].cat.set_categories(["original", "base", "comp"]) 
+        self.items = pd.concat([self.items, pd.DataFrame(new_items)], ignore_index=True)
+    
+    def _stream_sheet(self, worksheet, metadata_row, buffer, items, problems, new_items):
+        """
+        Helper function for stream_excel_input(): reads one sheet in chunks of STREAM_CHUNK_ROWS rows, appending its records 
+        to buffer, its raw items to items, its problems to problems and its new items to new_items
+        
+        Like pd.read_excel(), blank rows are kept (and reported as non-string items) except trailing ones, 
+        and trailing columns without any value are dropped
+        """
+        sheet_name = metadata_row['tab']
+        rows = worksheet.iter_rows(values_only=True)
+        first_row = next(rows, ())
+        header = [f'Unnamed: {i}' if x is None else x for i, x in enumerate(first_row)]
+        n_columns = len(header)
+        width = _get_width(first_row)  # number of columns up to the last one with any value
+        
+        def track_width(rows):
+            nonlocal width
+            for row in rows:
+                row = row[:n_columns] + (None,) * (n_columns - len(row))
+                width = max(width, _get_width(row))
+                yield row
+        
+        header, item_rows = clean_format.clean_rows(header, track_width(rows), self._get_sheet_format(metadata_row), metadata_row)
+        if not header or header[0] != 'item':
+            problems.append(('missing item column', sheet_name, np.nan, header[0] if header else np.nan, np.nan, np.nan))
+            return
+        periods = np.array(header[1:], dtype=object)
+        n_periods = len(periods)
+        scale = clean_format.get_scale(metadata_row)
+        
+        sheet_start, items_start, new_items_start = buffer.size, len(items['item']), len(new_items['name'])
+        seen_names = set()
+        n_rows = 0
+        n_rows_to_keep = 0  # up to the last non-blank row
+        while True:
+            chunk = list(islice(item_rows, self.STREAM_CHUNK_ROWS))
+            if not chunk:
+                break
+            raw_items = np.array([np.nan if raw_item is None else raw_item for raw_item, _ in chunk], dtype=object)
+            raw_values = np.array([row_values for _, row_values in chunk], dtype=object).reshape(len(chunk), n_periods)
+            del chunk
+            row_nums = np.arange(n_rows, n_rows + len(raw_items))
+            n_rows += len(raw_items)
+            is_blank = pd.isna(raw_items) & pd.isna(raw_values).all(axis=1)
+            if not is_blank.all():
+                n_rows_to_keep = row_nums[~is_blank][-1] + 1
+            
+            values, is_non_numeric = clean_format.coerce_row_values(raw_values, scale=scale)
+            for row, col in zip(*np.nonzero(is_non_numeric)):
+                problems.append(('non-numeric value', sheet_name, row_nums[row], raw_items[row], periods[col], raw_values[row, col]))
+            
+            names = pd.Series(raw_items, dtype=object).str.strip().str.lower().to_numpy()
+            items['source'] += [sheet_name] * len(raw_items)
+            items['row_num'] += row_nums.tolist()
+            items['item'] += raw_items.tolist()
+            for raw_item, name in zip(raw_items, names):
+                if isinstance(name, str) and name not in seen_names:
+                    seen_names.add(name)
+                    new_items['raw_name'].append(raw_item)
+                    new_items['source'].append(sheet_name)
+                    new_items['name'].append(name)
+            
+            # long format: for each item, for each period (the same order as process_raw_data())
+            buffer.extend(
+                values.size,
+                source=sheet_name,
+                record_type='original',
+                period=np.tile(periods, len(raw_items)),
+                row_num=np.repeat(row_nums, n_periods),
+                item=np.repeat(names, n_periods),
+                raw_item=np.repeat(raw_items, n_periods),
+                value=np.nan_to_num(values.ravel(), nan=0),
+                raw_value=values.ravel(),
+            )
+        
+        # drop trailing blank rows, then trailing columns without any value
+        buffer.truncate(sheet_start + n_rows_to_keep * n_periods)
+        for column in items.values():
+            del column[items_start + n_rows_to_keep:]
+        n_periods_to_keep = min(max(width - 1, 0), n_periods)
+        if n_periods_to_keep < n_periods:
+            buffer.keep(sheet_start, np.tile(np.arange(n_periods) < n_periods_to_keep, n_rows_to_keep))
+        if not n_periods_to_keep:
+            # no record refers to the items of the sheet
+            for column in new_items.values():
+                del column[new_items_start:]
                 
-    def _clean_raw_value(self, raw_value):
+    def validate_raw_data(self):
+        """
+        checks raw data (i.e. self.data_dfs) for every problem below at once and raises a ValueError listing all of them:
+        - missing tab: a tab in metadata that is not in the input Excel file
+        - missing item column: the first column could not be cleaned into 'item'
+        - non-string item: item that is empty or is not text
+        - duplicated item: the same item (after strip() and lower()) more than once in the same source
+        - non-numeric value: value that is neither empty nor a number
         """
-        Helper function for insert_record(): cleans raw_value to return value
+        problems = []
+        items = []
+        for raw_source, df in self.data_dfs.items():
+            # an empty sheet has no columns at all
+            if not len(df.columns) or df.columns[0] != 'item':
+                problems.append(pd.DataFrame({'problem': ['missing item column'], 'source': [raw_source], 
+                                              'item': [df.columns[0] if len(df.columns) else np.nan]}))
+                continue
+            items.append(pd.DataFrame({'source': raw_source, 'row_num': np.arange(len(df)), 'item': df['item'].values}))
+            
+            # non-numeric values, located by (row_num, period)
+            values = df.iloc[:, 1:]
+            is_non_numeric = values.notna() & values.apply(pd.to_numeric, errors='coerce').isna()
+            if is_non_numeric.values.any():
+                row_nums, col_nums = np.nonzero(is_non_numeric.values)
+                problems.append(pd.DataFrame({
+                    'problem': 'non-numeric value',
+                    'source': raw_source,
+                    'row_num': row_nums,
+                    'item': df['item'].values[row_nums],
+                    'period': values.columns[col_nums],
+                    'value': values.values[row_nums, col_nums],
+                }))
+                
+        self._report_problems(pd.concat(items, ignore_index=True) if items else None, problems)
+    
+    def _report_problems(self, items, problems):
         """
+        Helper function for validate_raw_data() and stream_excel_input(): adds missing tabs, non-string items and duplicated items
+        to problems, and raises a ValueError if there is any
         
-        # NA is considered zero
-        if isinstance(raw_value, (np.float64, float)) and np.isnan(raw_value):
-            value = 0
-        else:
-            value = raw_value
-        return value  
+        - items (DataFrame): 'source', 'row_num', 'item' (raw item) of every row of every sheet, or None if there is no sheet
+        - problems (list): DataFrames of problems already found (e.g. non-numeric values)
+        """
+        problems = [pd.DataFrame({'problem': 'missing tab', 'source': self.missing_tabs})] + problems
+        if items is not None and len(items):
+            is_string = items['item'].map(type) == str
+            problems.append(items[~is_string].assign(problem='non-string item'))
+            
+            # duplicated items are checked on the cleaned item name, which is what self.data is keyed on
+            names = items.loc[is_string, ['source', 'row_num', 'item']].assign(name=lambda x: x['item'].str.strip().str.lower())
+            problems.append(names[names.duplicated(subset=['source', 'name'], keep=False)].drop(columns='name').assign(problem='duplicated item'))
+        
+        self.validation_report = pd.concat([self.validation_report] + problems, ignore_index=True).astype({'row_num': 'Int64'})
+        if not self.validation_report.empty:
+            raise ValueError(f"Found {len(self.validation_report)} problems in the input Excel file:\n{self.validation_report.to_string()}")
     
     def _register_item(self, raw_item, raw_source):
         """
@@ -105,11 +321,7 @@ class Read_Excel_Input:
         Helper function for process_raw_data(): inserts a new record into self._raw_data
         """
         
-        value = self._clean_raw_value(raw_value)
-        try:
-            item = self._register_item(raw_item, raw_source)
-        except:
-            raise ValueError(f"raw_item: {raw_item}, raw_source: {raw_source}")
+        item = self._register_item(raw_item, raw_source)
         
         row_num = int(row_num)
             
@@ -121,7 +333,7 @@ class Read_Excel_Input:
             row_num=row_num,
             item=item,
             raw_item=raw_item,
-            value=value,
+            value=raw_value,  # NA is considered zero, which is applied to the whole column by initialize_data()
             raw_value=raw_value,            
         )        
         self._raw_data.append(record)
@@ -134,12 +346,8 @@ class Read_Excel_Input:
         for raw_source in self.metadata_df['tab'].values:    
             print(f'{raw_source}', end=" ")
             
-            # clean format (may be different for each filing)
-            df = clean_format.clean_column_headings(self.data_dfs[raw_source])
-            
-            # check no duplicated items from the same source
-            if df.duplicated(subset=['item'], keep=False).sum() > 0:
-                raise ValueError(f"Cannot have duplicated item name in the same source:\n {df[df.duplicated(subset=['item'], keep=False)]}")
+            # Note: format has been cleaned by read_excel_input(), and items and values have been checked by validate_raw_data()
+            df = self.data_dfs[raw_source]
                 
             # insert record
             for row_num, x in enumerate(df.to_dict('records')):
@@ -156,9 +364,7 @@ class Read_Excel_Input:
         """
         print('initializing self.data...')
         self.data = pd.DataFrame(self._raw_data)
-        self.data['record_type'] = pd.Categorical(self.data['record_type'], ["original", "base", "comp"]) 
-        
-        # Given a same source, verify you only have one item (i.e. no duplicated items)
-        # already checked before, but does not hurt to check again
-        if self.data.groupby(['source', 'period', 'item']).size().max() != 1:
-            raise ValueError('Same source has duplicate items...')
\ No newline at end of file
+        # NA is considered zero; values are float64 even when every cell is an integer, as in streaming mode
+        self.data['value'] = self.data['value'].fillna(0).astype(float)
+        self.data['raw_value'] = self.data['raw_value'].astype(float)
+        self.data['record_type'] = pd.Categorical(self.data['record_type'], ["original", "base", "comp"]) 
\ No newline at end of file
@@ -0,0 +1,68 @@
+import os
+import time
+import hashlib
+
+from .read_excel_input import Read_Excel_Input
+from .consolidated_table import Consolidated_Table
+
+
+def consolidate(input_excel_file, output_excel_file, irreconcilable, state_dir=None, n_jobs=None, streaming=False):
+    """
+    reads input_excel_file and consolidates all the sources into output_excel_file
+
+    when state_dir is given, a checkpoint is saved after each source and the next run only consolidates
+    from the first source (in metadata order) whose sheet, comp_like or item_manual_mappings changed
+    """
+    rei = Read_Excel_Input(input_excel_file, streaming=streaming)
+    ct = Consolidated_Table(rei, output_excel_file, irreconcilable=irreconcilable, n_jobs=n_jobs, state_dir=state_dir)
+    while ct.sources_to_consolidate:
+        ct.consolidate_next_source()
+    return ct
+
+
+def _hash_file(file_name):
+    """
+    Helper function for watch(): content hash of a file
+    """
+    h = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def watch(input_excel_file, output_excel_file, irreconcilable, state_dir=None, n_jobs=None, streaming=False, interval=2):
+    """
+    re-runs consolidate() every time the content of input_excel_file changes, until interrupted (Ctrl+C)
+
+    state_dir defaults to '<output_excel_file>.state' so that only the sources affected by an edit are re-consolidated
+    """
+    if state_dir is None:
+        state_dir = output_excel_file + '.state'
+
+    last_mtime, last_hash = None, None
+    try:
+        while True:
+            try:
+                # the file can briefly disappear (saved through a temporary file) or be locked (Windows) while Excel saves it;
+                # last_mtime is only updated once the file could be hashed, so it is retried on the next poll
+                mtime = os.path.getmtime(input_excel_file)
+                if mtime != last_mtime:
+                    file_hash = _hash_file(input_excel_file)
+                    last_mtime = mtime
+                    if file_hash != last_hash:
+                        last_hash = file_hash
+                        try:
+                            consolidate(input_excel_file, output_excel_file, irreconcilable, state_dir=state_dir, n_jobs=n_jobs, streaming=streaming)
+                        except Exception as e:
+                            # keep watching so that the analyst can fix the input and save again
+                            print(f"Failed to consolidate {input_excel_file}: {e!r}")
+                            if isinstance(e, OSError):
+                                # e.g. the file was locked again while being read: retry on the next poll
+                                last_mtime, last_hash = None, None
+                        print(f"Watching {input_excel_file} for changes...")
+            except OSError:
+                pass
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("Stopped watching.")